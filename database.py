@@ -1,388 +1,728 @@
 # database.py
+"""
+SQLite backend for the Streamlit store: schema, seeding, auth and queries.
+Read helpers are cached with st.cache_data and cleared by the writers.
+"""
+from __future__ import annotations
+
+import streamlit as st
 import sqlite3
+import bcrypt
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerifyMismatchError
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+import hashlib, hmac, itertools, os, queue, threading
+from collections import Counter
 from contextlib import contextmanager
-from datetime import datetime
-import hashlib
-import os
-from typing import List, Dict, Any, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
-DB_PATH = "nike_store.db"
+# --------------------------
+# DB PATH (Streamlit Cloud safe)
+# --------------------------
+def choose_db_path(filename: str = "nike_store.db") -> str:
+    # Prefer /mnt/data on Streamlit Cloud (writable)
+    if os.path.isdir("/mnt/data") and os.access("/mnt/data", os.W_OK):
+        return os.path.join("/mnt/data", filename)
+    # Otherwise use same directory as script
+    base = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(base, filename)
 
-def _hash_password(password: str, salt: Optional[str] = None) -> Tuple[str, str]:
-    if not salt:
-        salt = os.urandom(16).hex()
-    hashed = hashlib.sha256((salt + password).encode("utf-8")).hexdigest()
-    return hashed, salt
+DB_PATH = choose_db_path("nike_store.db")
 
-@contextmanager
-def get_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+# --------------------------
+# DB helpers
+# --------------------------
+# Argon2id, OWASP baseline (m=46 MiB, t=1, p=1)
+_PH = PasswordHasher(memory_cost=46 * 1024, time_cost=1, parallelism=1)
+
+def _hash_password(password: str) -> Tuple[str, str]:
+    """Argon2id hash; salt and params are embedded in the hash, so the salt column is left empty."""
+    return _PH.hash(password), ""
+
+# Verified against on unknown usernames so a miss costs the same as a wrong password
+_DUMMY_HASH = _PH.hash("not-a-real-password")
+
+def _is_legacy_hash(stored_hash: str) -> bool:
+    """True for pre-Argon2 rows and for Argon2 rows hashed with older params."""
+    if not stored_hash.startswith("$argon2"):
+        return True
+    return _PH.check_needs_rehash(stored_hash)
+
+_BCRYPT_MAX_BYTES = 72
+
+def _verify_password(password: str, stored_hash: str, salt: str) -> bool:
+    if stored_hash.startswith("$argon2"):
+        try:
+            return _PH.verify(stored_hash, password)
+        except (VerifyMismatchError, InvalidHashError):
+            return False
+    if stored_hash.startswith("$2"):
+        # Rows written before Argon2: bcrypt. bcrypt only ever hashed the first 72 bytes, and
+        # bcrypt>=5 raises on longer input, so mirror the truncation; login then rehashes
+        # the full password with Argon2.
+        try:
+            return bcrypt.checkpw(password.encode("utf-8")[:_BCRYPT_MAX_BYTES], stored_hash.encode("ascii"))
+        except ValueError:  # malformed stored hash: a failed login, not a crash
+            return False
+    # Oldest rows: salted SHA-256 hex digest
+    test_hash = hashlib.sha256((salt + password).encode("utf-8")).hexdigest()
+    return hmac.compare_digest(test_hash, stored_hash)
+
+# Long-lived connections: N pooled readers + one writer (WAL lets readers run alongside it)
+READ_POOL_SIZE = 4
+_PRAGMAS = (
+    "PRAGMA page_size=8192",  # only takes effect on a new, empty file, so it must precede WAL
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA mmap_size=268435456",
+)
+
+def _connect(read_only: bool = False) -> sqlite3.Connection:
+    # Autocommit; multi-statement writes use an explicit BEGIN
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
+    if read_only:
+        conn.execute("PRAGMA query_only=ON")
+    return conn
+
+@st.cache_resource(show_spinner=False)
+def _readers() -> "queue.Queue[sqlite3.Connection]":
+    pool: "queue.Queue[sqlite3.Connection]" = queue.Queue(maxsize=READ_POOL_SIZE)
+    for _ in range(READ_POOL_SIZE):
+        pool.put(_connect(read_only=True))
+    return pool
+
+@st.cache_resource(show_spinner=False)
+def _writer() -> Tuple[sqlite3.Connection, threading.Lock]:
+    return _connect(), threading.Lock()
+
+@contextmanager
+def get_read_conn():
+    """Borrow a pooled read-only connection; it goes back to the pool, never closed."""
+    pool = _readers()
+    conn = pool.get()
     try:
         yield conn
     finally:
-        conn.close()
+        pool.put(conn)
 
-def init_db():
-    with get_conn() as conn:
-        c = conn.cursor()
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            password_salt TEXT NOT NULL,
-            is_admin INTEGER NOT NULL DEFAULT 0,
-            created_at TEXT NOT NULL
-        )""")
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            price REAL NOT NULL,
-            image TEXT,
-            category TEXT,
-            description TEXT,
-            stock INTEGER NOT NULL DEFAULT 0,
-            created_at TEXT NOT NULL
-        )""")
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS orders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            created_at TEXT NOT NULL,
-            total REAL NOT NULL DEFAULT 0,
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        )""")
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS order_items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            order_id INTEGER NOT NULL,
-            product_id INTEGER NOT NULL,
-            quantity INTEGER NOT NULL,
-            price_each REAL NOT NULL,
-            FOREIGN KEY(order_id) REFERENCES orders(id),
-            FOREIGN KEY(product_id) REFERENCES products(id)
-        )""")
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS reviews (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            product_id INTEGER NOT NULL,
-            rating INTEGER NOT NULL CHECK(rating BETWEEN 1 AND 5),
-            comment TEXT,
-            created_at TEXT NOT NULL,
-            UNIQUE(user_id, product_id),
-            FOREIGN KEY(user_id) REFERENCES users(id),
-            FOREIGN KEY(product_id) REFERENCES products(id)
-        )""")
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS wishlist (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            product_id INTEGER NOT NULL,
-            created_at TEXT NOT NULL,
-            UNIQUE(user_id, product_id),
-            FOREIGN KEY(user_id) REFERENCES users(id),
-            FOREIGN KEY(product_id) REFERENCES products(id)
-        )""")
-        conn.commit()
-
-def seed_products():
-    with get_conn() as conn:
-        c = conn.cursor()
-        c.execute("SELECT COUNT(*) FROM products")
-        if c.fetchone()[0] > 0:
-            return
-        now = datetime.utcnow().isoformat()
+@contextmanager
+def get_write_conn():
+    """Exclusive use of the single writer connection. Every write goes through here, so no
+    other session's statement or commit can land inside an open BEGIN ... COMMIT."""
+    conn, lock = _writer()
+    with lock:
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:  # never hand over a half-finished transaction
+                conn.rollback()
+
+_REVIEW_AGG_SET = """avg_rating = (SELECT COALESCE(AVG(rating),0) FROM reviews r WHERE r.product_id = products.id),
+                review_count = (SELECT COUNT(*) FROM reviews r WHERE r.product_id = products.id)"""
+
+def _tuple_cursor(conn: sqlite3.Connection) -> sqlite3.Cursor:
+    """Cursor returning plain tuples (no per-row sqlite3.Row) for the bulk listing reads."""
+    c = conn.cursor()
+    c.row_factory = None
+    return c
+
+def _fetch_dicts(c: sqlite3.Cursor) -> List[Dict[str, Any]]:
+    cols = [d[0] for d in c.description]
+    return [dict(zip(cols, r)) for r in c.fetchall()]
+
+def _to_cents(price) -> int:
+    """The one price rounding rule: to the cent, half away from zero (via the shortest repr,
+    so 10.125 -> 1013 rather than banker's 1012)."""
+    return int(Decimal(str(price)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP) * 100)
+
+def _add_column_if_missing(c, table: str, column: str, decl: str) -> bool:
+    """ALTER TABLE ... ADD COLUMN for databases created before the column existed."""
+    c.execute(f"PRAGMA table_info({table})")
+    if any(r["name"] == column for r in c.fetchall()):
+        return False
+    c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    return True
+
+def _create_schema(c):
+    """Create tables, triggers and indexes only if they don't exist."""
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        password_salt TEXT NOT NULL,
+        is_admin INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL
+    )""")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        price REAL NOT NULL,
+        price_cents INTEGER NOT NULL DEFAULT 0,
+        image TEXT,
+        images TEXT,
+        category TEXT,
+        description TEXT,
+        stock INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL,
+        avg_rating REAL NOT NULL DEFAULT 0,
+        review_count INTEGER NOT NULL DEFAULT 0
+    )""")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS reviews (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        rating INTEGER NOT NULL CHECK(rating BETWEEN 1 AND 5),
+        comment TEXT,
+        created_at TEXT NOT NULL,
+        UNIQUE(user_id, product_id)
+    )""")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS wishlist (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        created_at TEXT NOT NULL,
+        UNIQUE(user_id, product_id)
+    )""")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        created_at TEXT NOT NULL,
+        total REAL NOT NULL
+    )""")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS order_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        price_each REAL NOT NULL
+    )""")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS releases (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        product_id INTEGER,
+        drop_datetime TEXT NOT NULL,
+        description TEXT
+    )""")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS stores (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT, city TEXT, address TEXT, phone TEXT, lat REAL, lon REAL
+    )""")
+    # Materialized review aggregates on products, kept in sync by triggers
+    added = _add_column_if_missing(c, "products", "avg_rating", "REAL NOT NULL DEFAULT 0")
+    added |= _add_column_if_missing(c, "products", "review_count", "INTEGER NOT NULL DEFAULT 0")
+    # A new review folds into the running average in O(1); edits and deletes recompute
+    # from the (product_id, rating) index so the average can't drift
+    review_triggers = {
+        "INSERT": """UPDATE products SET avg_rating = (avg_rating*review_count + NEW.rating) / (review_count + 1),
+                        review_count = review_count + 1 WHERE id = NEW.product_id""",
+        "UPDATE": f"UPDATE products SET {_REVIEW_AGG_SET} WHERE id IN (OLD.product_id, NEW.product_id)",
+        "DELETE": f"UPDATE products SET {_REVIEW_AGG_SET} WHERE id = OLD.product_id",
+    }
+    for event, body in review_triggers.items():
+        # Recreated each start so changes to the trigger body reach existing databases
+        c.execute(f"DROP TRIGGER IF EXISTS trg_reviews_{event.lower()}")
+        c.execute(f"""
+        CREATE TRIGGER trg_reviews_{event.lower()} AFTER {event} ON reviews
+        BEGIN
+            {body};
+        END""")
+    if added:
+        c.execute(f"UPDATE products SET {_REVIEW_AGG_SET}")
+    # Integer cents for price filters/sorts; `price` stays for existing readers
+    if _add_column_if_missing(c, "products", "price_cents", "INTEGER NOT NULL DEFAULT 0"):
+        # Backfill through _to_cents so migrated rows round exactly like new writes
+        c.execute("SELECT id, price FROM products")
+        c.executemany("UPDATE products SET price_cents=? WHERE id=?",
+                      [(_to_cents(r["price"]), r["id"]) for r in c.fetchall()])
+        # `images` only holds extra images; product_detail already falls back to `image`
+        c.execute("UPDATE products SET images = NULL WHERE images = image")
+    # Full-text index over the product text (external content: rows live in products only)
+    c.execute("SELECT 1 FROM sqlite_master WHERE name='products_fts'")
+    fts_missing = c.fetchone() is None
+    c.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, description, category,
+        content='products', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""")
+    fts_cols = "name, description, category"
+    fts_new = "NEW.id, NEW.name, NEW.description, NEW.category"
+    fts_del = "'delete', OLD.id, OLD.name, OLD.description, OLD.category"
+    for name, event, body in (
+        ("ai", "INSERT", f"INSERT INTO products_fts(rowid, {fts_cols}) VALUES ({fts_new});"),
+        ("ad", "DELETE", f"INSERT INTO products_fts(products_fts, rowid, {fts_cols}) VALUES ({fts_del});"),
+        ("au", f"UPDATE OF {fts_cols}",
+         f"INSERT INTO products_fts(products_fts, rowid, {fts_cols}) VALUES ({fts_del});"
+         f" INSERT INTO products_fts(rowid, {fts_cols}) VALUES ({fts_new});"),
+    ):
+        c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_products_fts_{name} AFTER {event} ON products
+        BEGIN
+            {body}
+        END""")
+    if fts_missing:
+        c.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+    # Superseded by the composite indexes below (same leading column)
+    for old_idx in ("idx_products_cat", "idx_orders_user", "idx_reviews_pid"):
+        c.execute(f"DROP INDEX IF EXISTS {old_idx}")
+    # Stand-in for CHECK(stock >= 0), which SQLite can't add to an existing table:
+    # an oversell aborts the statement (and place_order's transaction)
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_products_stock_nonneg BEFORE UPDATE OF stock ON products
+    WHEN NEW.stock < 0
+    BEGIN
+        SELECT RAISE(ABORT, 'stock cannot go negative');
+    END""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_products_price_cents ON products(price_cents)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_products_cat_price ON products(category, price_cents)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_products_created ON products(created_at DESC)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_products_rating ON products(avg_rating DESC)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_products_stock ON products(stock)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders(user_id, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_created ON orders(created_at DESC)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id)")
+    # Covering for the review-aggregate triggers' AVG(rating); also serves get_reviews()
+    c.execute("CREATE INDEX IF NOT EXISTS idx_reviews_product ON reviews(product_id, rating)")
+
+# Rows per executemany batch; keeps future seed growth under SQLITE_MAX_VARIABLE_NUMBER
+SEED_CHUNK_ROWS = 500
+
+def _executemany_chunked(c, sql: str, rows: List[Tuple], chunk: int = SEED_CHUNK_ROWS):
+    for i in range(0, len(rows), chunk):
+        c.executemany(sql, rows[i:i+chunk])
+
+def _seed_if_empty(c, admin_hash: Tuple[str, str]):
+    """Insert sample data into whichever tables are still empty."""
+    # One timestamp for the whole seed, formatted once and bound for every row
+    now_dt = datetime.utcnow()
+    now = now_dt.isoformat()
+    # seed products
+    c.execute("SELECT COUNT(*) FROM products")
+    if c.fetchone()[0] == 0:
         products = [
-            ("Air Max 270", 150, "https://images.unsplash.com/photo-1606813903134-45c28b953b3f", "Running",
-             "Breathable mesh with bold Air cushioning.", 25, now),
-            ("Jordan Retro", 200, "https://images.unsplash.com/photo-1542291026-7eec264c27ff", "Basketball",
-             "Iconic style meets modern support.", 18, now),
-            ("Blazer Mid '77", 120, "https://images.unsplash.com/photo-1595950653171-47c33e5f1d6e", "Casual",
-             "Vintage vibes with everyday comfort.", 30, now),
-            ("Pegasus Trail 4", 140, "https://images.unsplash.com/photo-1542291026-7eec264c27ff?ixlib=rb-4.0.3", "Trail",
-             "Grip and glide for off-road miles.", 15, now),
-            ("Metcon 9", 130, "https://images.unsplash.com/photo-1600180758890-6b94519a8ba6", "Training",
-             "Stable platform for heavy lifts.", 22, now),
-            ("ZoomX Vaporfly", 250, "https://images.unsplash.com/photo-1519741497674-611481863552", "Racing",
-             "Featherweight speed with propulsive foam.", 10, now),
+            ("Air Max 270", 150, "https://images.unsplash.com/photo-1606813903134-45c28b953b3f", None,
+             "Running", "Breathable mesh with bold Air cushioning.", 25, now),
+            ("Jordan Retro", 200, "https://images.unsplash.com/photo-1542291026-7eec264c27ff", None,
+             "Basketball", "Iconic style meets modern support.", 18, now),
+            ("Blazer Mid '77", 120, "https://images.unsplash.com/photo-1595950653171-47c33e5f1d6e", None,
+             "Casual", "Vintage vibes with everyday comfort.", 30, now),
+            ("ZoomX Vaporfly", 250, "https://images.unsplash.com/photo-1519741497674-611481863552", None,
+             "Racing", "Featherweight speed with propulsive foam.", 10, now),
+        ]
+        _executemany_chunked(c, """INSERT INTO products(name,price,price_cents,image,images,category,description,stock,created_at)
+                         VALUES (?,?,?,?,?,?,?,?,?)""",
+                            [(n, pr, _to_cents(pr), *rest) for n, pr, *rest in products])
+    # seed admin
+    c.execute("SELECT COUNT(*) FROM users WHERE is_admin=1")
+    if c.fetchone()[0] == 0:
+        h, s = admin_hash
+        c.execute("INSERT INTO users(username,password_hash,password_salt,is_admin,created_at) VALUES (?,?,?,?,?)",
+                  ("admin", h, s, 1, now))
+    # seed releases
+    c.execute("SELECT COUNT(*) FROM releases")
+    if c.fetchone()[0] == 0:
+        drops = [
+            ("Air Max Holiday Drop", 1, (now_dt + timedelta(days=2)).isoformat(), "Limited colors."),
+            ("Jordan Retro OG", 2, (now_dt + timedelta(days=5, hours=4)).isoformat(), "Retro pack release."),
+        ]
+        _executemany_chunked(c, "INSERT INTO releases(title,product_id,drop_datetime,description) VALUES (?,?,?,?)", drops)
+    # seed stores
+    c.execute("SELECT COUNT(*) FROM stores")
+    if c.fetchone()[0] == 0:
+        stores = [
+            ("Nike Flagship NYC","New York","650 Broadway","(212)555-0100",40.7249,-73.9940),
+            ("Nike Downtown LA","Los Angeles","800 S Grand Ave","(213)555-0199",34.0407,-118.2468),
+            ("Nike The Loop","Chicago","201 N State St","(312)555-0123",41.8837,-87.6278),
         ]
-        c.executemany("""
-            INSERT INTO products(name, price, image, category, description, stock, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, products)
-        conn.commit()
-
-def seed_admin():
-    with get_conn() as conn:
+        _executemany_chunked(c, "INSERT INTO stores(name,city,address,phone,lat,lon) VALUES (?,?,?,?,?,?)", stores)
+
+def init_db():
+    """Schema, migrations and seed data in one explicit transaction (single fsync)."""
+    # Argon2 runs before taking the writer; it's only used if the admin row is missing
+    admin_hash = _hash_password("admin123")
+    with get_write_conn() as conn:
         c = conn.cursor()
-        c.execute("SELECT COUNT(*) FROM users WHERE is_admin=1")
-        if c.fetchone()[0] == 0:
-            now = datetime.utcnow().isoformat()
-            pwd_hash, salt = _hash_password("admin123")
-            c.execute("""
-                INSERT INTO users(username, password_hash, password_salt, is_admin, created_at)
-                VALUES (?, ?, ?, ?, ?)
-            """, ("admin", pwd_hash, salt, 1, now))
-            conn.commit()
+        c.execute("BEGIN")
+        try:
+            _create_schema(c)
+            _seed_if_empty(c, admin_hash)
+            c.execute("COMMIT")
+        except Exception:
+            conn.rollback()
+            raise
+        # Gather planner statistics once, after there is data to sample
+        c.execute("SELECT 1 FROM sqlite_master WHERE name='sqlite_stat1'")
+        if c.fetchone() is None:
+            c.execute("ANALYZE")
 
-# Users
-def register_user(username: str, password: str) -> Tuple[bool, str]:
+# --------------------------
+# Backend functions
+# --------------------------
+def register_user(username: str, password: str) -> Tuple[bool,str]:
     if not username or not password:
-        return False, "Username and password required."
+        return False, "Username & password required."
     if len(username) < 3:
-        return False, "Username must be >= 3 chars."
+        return False, "Username must be at least 3 characters."
     if len(password) < 6:
-        return False, "Password must be >= 6 chars."
-    try:
-        with get_conn() as conn:
+        return False, "Password must be at least 6 characters."
+    # Hash before taking the writer so other writes don't queue behind it
+    h, s = _hash_password(password)
+    with get_write_conn() as conn:
+        try:
             c = conn.cursor()
-            pwd_hash, salt = _hash_password(password)
             now = datetime.utcnow().isoformat()
-            c.execute("""
-                INSERT INTO users(username, password_hash, password_salt, is_admin, created_at)
-                VALUES (?, ?, ?, 0, ?)
-            """, (username.strip(), pwd_hash, salt, now))
-            conn.commit()
-            return True, "Registration successful."
-    except sqlite3.IntegrityError:
-        return False, "Username already exists."
-    except Exception as e:
-        return False, f"Error: {e}"
+            c.execute("INSERT INTO users(username,password_hash,password_salt,is_admin,created_at) VALUES (?,?,?,?,?)",
+                      (username.strip(),h,s,0,now))
+            admin_metrics.clear()
+            return True, "Registered successfully."
+        except sqlite3.IntegrityError:
+            return False, "Username already exists."
+        except Exception as e:
+            return False, str(e)
 
-def authenticate(username: str, password: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
-    with get_conn() as conn:
+def authenticate(username: str, password: str) -> Tuple[bool, Optional[Dict[str,Any]]]:
+    with get_read_conn() as conn:
         c = conn.cursor()
-        c.execute("SELECT * FROM users WHERE username=?", (username.strip(),))
+        c.execute("SELECT id, username, is_admin, password_hash, password_salt FROM users WHERE username=?",
+                  (username.strip(),))
         row = c.fetchone()
-        if not row:
-            return False, None
-        stored_hash = row["password_hash"]
-        salt = row["password_salt"]
-        test_hash, _ = _hash_password(password, salt)
-        if test_hash == stored_hash:
-            return True, dict(row)
+    if not row:
+        _verify_password(password, _DUMMY_HASH, "")
         return False, None
+    if not _verify_password(password, row["password_hash"], row["password_salt"]):
+        return False, None
+    if _is_legacy_hash(row["password_hash"]):
+        # Transparently upgrade legacy rows on successful login
+        h, s = _hash_password(password)
+        with get_write_conn() as conn:
+            # Skip if the password changed since the read above
+            conn.execute("UPDATE users SET password_hash=?, password_salt=? WHERE id=? AND password_hash=?",
+                         (h, s, row["id"], row["password_hash"]))
+    # Session copy only; the hash never leaves this function
+    return True, {"id": row["id"], "username": row["username"], "is_admin": row["is_admin"]}
 
-def change_password(user_id: int, old_password: str, new_password: str) -> Tuple[bool, str]:
-    if len(new_password) < 6:
-        return False, "New password must be >= 6 chars."
-    with get_conn() as conn:
+def change_password(user_id:int, old_pw:str, new_pw:str) -> Tuple[bool,str]:
+    if len(new_pw) < 6:
+        return False, "New password too short."
+    with get_read_conn() as conn:
         c = conn.cursor()
-        c.execute("SELECT password_hash, password_salt FROM users WHERE id=?", (user_id,))
+        c.execute("SELECT password_hash,password_salt FROM users WHERE id=?", (user_id,))
         row = c.fetchone()
-        if not row:
-            return False, "User not found."
-        old_hash, _ = _hash_password(old_password, row["password_salt"])
-        if old_hash != row["password_hash"]:
-            return False, "Old password incorrect."
-        new_hash, new_salt = _hash_password(new_password)
-        c.execute("UPDATE users SET password_hash=?, password_salt=? WHERE id=?", (new_hash, new_salt, user_id))
-        conn.commit()
+    if not row:
+        return False, "User not found."
+    if not _verify_password(old_pw, row["password_hash"], row["password_salt"]):
+        return False, "Old password incorrect."
+    h_new, s_new = _hash_password(new_pw)
+    # Writer only for the UPDATE; matching the old hash keeps a concurrent change from being overwritten
+    with get_write_conn() as conn:
+        c = conn.cursor()
+        c.execute("UPDATE users SET password_hash=?, password_salt=? WHERE id=? AND password_hash=?",
+                  (h_new, s_new, user_id, row["password_hash"]))
+        if c.rowcount == 0:
+            return False, "Password was changed elsewhere; please try again."
         return True, "Password updated."
 
-# Products & listing
-def list_products(search: str = "", category: str = "", price_min: float = None, price_max: float = None,
-                  sort_by: str = "newest", page: int = 1, page_size: int = 6):
-    where = []
+# Products
+# Columns the product grid and hero read; leaves out `images` and `created_at`
+_CARD_COLS = "id, name, price, price_cents, image, category, description, stock, avg_rating, review_count"
+_CARD_COLS_P = ", ".join("p." + col for col in _CARD_COLS.split(", "))  # for joins aliasing products as p
+
+_LIST_ORDER = {
+    "price_asc": "ORDER BY price_cents ASC",
+    "price_desc": "ORDER BY price_cents DESC",
+    "rating_desc": "ORDER BY avg_rating DESC",
+    "newest": "ORDER BY created_at DESC",
+}
+
+def _list_sql(has_search: bool, has_category: bool, has_pmin: bool, has_pmax: bool, sort_by: str) -> Tuple[str, str]:
+    """(count_sql, page_sql) for one filter shape."""
+    where = [clause for present, clause in (
+        (has_search, "id IN (SELECT rowid FROM products_fts WHERE products_fts MATCH ?)"),
+        (has_category, "category = ?"),
+        (has_pmin, "price_cents >= ?"),
+        (has_pmax, "price_cents <= ?"),
+    ) if present]
+    where_sql = ("WHERE " + " AND ".join(where)) if where else ""
+    order_sql = _LIST_ORDER.get(sort_by, _LIST_ORDER["newest"])
+    return (f"SELECT COUNT(*) FROM products {where_sql}",
+            f"SELECT {_CARD_COLS} FROM products {where_sql} {order_sql} LIMIT ? OFFSET ?")
+
+# Every filter shape (2^4 filter combos x sort orders) built once at import: list_products
+# does no SQL string building, and the same text keeps the statement cache hitting
+_LIST_SQL: Dict[Tuple, Tuple[str, str]] = {
+    (*flags, sort_by): _list_sql(*flags, sort_by)
+    for flags in itertools.product((False, True), repeat=4)
+    for sort_by in _LIST_ORDER
+}
+
+# Keyed on the (hashable) filter args; dict rows because st.cache_data pickles results
+@st.cache_data(ttl=10, max_entries=64, show_spinner=False)
+def list_products(search:str="", category:str="", price_min:float=None, price_max:float=None,
+                  sort_by:str="newest", page:int=1, page_size:int=6):
     params = []
-    if search:
-        where.append("LOWER(name) LIKE ?")
-        params.append(f"%{search.lower()}%")
-    if category and category != "All":
-        where.append("category = ?")
+    terms = search.replace('"', " ").split()
+    if terms:
+        # Each word is a quoted prefix term, so user input can't inject FTS5 syntax
+        params.append(" ".join(f'"{t}"*' for t in terms))
+    has_category = bool(category) and category != "All"
+    if has_category:
         params.append(category)
     if price_min is not None:
-        where.append("price >= ?"); params.append(price_min)
+        params.append(_to_cents(price_min))
     if price_max is not None:
-        where.append("price <= ?"); params.append(price_max)
-    where_sql = ("WHERE " + " AND ".join(where)) if where else ""
-    if sort_by == "price_asc":
-        order_sql = "ORDER BY price ASC"
-    elif sort_by == "price_desc":
-        order_sql = "ORDER BY price DESC"
-    elif sort_by == "rating_desc":
-        order_sql = "ORDER BY (SELECT COALESCE(AVG(rating),0) FROM reviews r WHERE r.product_id=products.id) DESC"
-    else:
-        order_sql = "ORDER BY datetime(created_at) DESC"
-    with get_conn() as conn:
-        c = conn.cursor()
-        c.execute(f"SELECT COUNT(*) FROM products {where_sql}", params)
+        params.append(_to_cents(price_max))
+    if sort_by not in _LIST_ORDER:
+        sort_by = "newest"
+    count_sql, page_sql = _LIST_SQL[bool(terms), has_category, price_min is not None,
+                                    price_max is not None, sort_by]
+
+    with get_read_conn() as conn:
+        c = _tuple_cursor(conn)
+        c.execute(count_sql, params)
         total = c.fetchone()[0]
-        offset = (page - 1) * page_size
-        c.execute(f"""
-            SELECT p.*,
-            (SELECT COALESCE(AVG(rating),0) FROM reviews r WHERE r.product_id = p.id) AS avg_rating,
-            (SELECT COUNT(*) FROM reviews r2 WHERE r2.product_id = p.id) AS review_count
-            FROM products p
-            {where_sql}
-            {order_sql}
-            LIMIT ? OFFSET ?
-        """, (*params, page_size, offset))
-        rows = c.fetchall()
+        offset = (page-1)*page_size
+        c.execute(page_sql, (*params, page_size, offset))
+        rows = _fetch_dicts(c)
         return rows, total
 
+@st.cache_data(ttl=30, show_spinner=False)
 def product_min_max_price():
-    with get_conn() as conn:
+    with get_read_conn() as conn:
         c = conn.cursor()
-        c.execute("SELECT MIN(price), MAX(price) FROM products")
-        mn, mx = c.fetchone()
-        return float(mn or 0.0), float(mx or 0.0)
+        c.execute("SELECT MIN(price_cents), MAX(price_cents) FROM products")
+        mn,mx = c.fetchone()
+        return (mn or 0) / 100, (mx or 0) / 100
 
+@st.cache_data(ttl=30, show_spinner=False)
 def product_categories():
-    with get_conn() as conn:
+    with get_read_conn() as conn:
         c = conn.cursor()
         c.execute("SELECT DISTINCT COALESCE(category,'Uncategorized') FROM products")
         cats = [r[0] for r in c.fetchall()]
         cats.sort()
         return ["All"] + cats
 
-def add_product(name, price, image, category, description, stock):
+@st.cache_data(ttl=15, show_spinner=False)
+def list_product_ids_names() -> List[Tuple[int,str]]:
+    """Lightweight (id, name) pairs for admin pickers."""
+    with get_read_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT id, name FROM products ORDER BY id")
+        return [(r["id"], r["name"]) for r in c.fetchall()]
+
+# By-id lookups behind the product page; cleared by product, review and order writes
+@st.cache_data(ttl=60, max_entries=512, show_spinner=False)
+def get_product(pid:int):
+    with get_read_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM products WHERE id=?", (pid,))
+        row = c.fetchone()
+        return dict(row) if row else None
+
+def _clear_catalog_caches():
+    """Drop cached catalog reads after a product write."""
+    list_products.clear()
+    product_min_max_price.clear()
+    product_categories.clear()
+    list_product_ids_names.clear()
+    get_product.clear()
+    admin_metrics.clear()
+
+def add_product(name,price,image,images,category,desc,stock):
+    cents = _to_cents(price)
+    price = cents / 100  # keep `price` equal to the rounded cents
     now = datetime.utcnow().isoformat()
-    with get_conn() as conn:
+    with get_write_conn() as conn:
         c = conn.cursor()
-        c.execute("""
-            INSERT INTO products(name, price, image, category, description, stock, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (name, price, image, category, description, stock, now))
-        conn.commit()
-        return True, "Product added."
-
-def update_product(pid, name, price, image, category, description, stock):
-    with get_conn() as conn:
+        c.execute("""INSERT INTO products(name,price,price_cents,image,images,category,description,stock,created_at)
+                     VALUES (?,?,?,?,?,?,?,?,?)""", (name,price,cents,image,images,category,desc,stock,now))
+        _clear_catalog_caches()
+        return True,"Added"
+
+def update_product(pid,name,price,image,images,category,desc,stock):
+    cents = _to_cents(price)
+    price = cents / 100
+    with get_write_conn() as conn:
         c = conn.cursor()
-        c.execute("""
-            UPDATE products SET name=?, price=?, image=?, category=?, description=?, stock=?
-            WHERE id=?
-        """, (name, price, image, category, description, stock, pid))
-        conn.commit()
-        return True, "Product updated."
+        c.execute("""UPDATE products SET name=?,price=?,price_cents=?,image=?,images=?,category=?,description=?,stock=? WHERE id=?""",
+                  (name,price,cents,image,images,category,desc,stock,pid))
+        _clear_catalog_caches()
+        return True,"Updated"
 
 def delete_product(pid):
-    with get_conn() as conn:
+    with get_write_conn() as conn:
         c = conn.cursor()
         c.execute("DELETE FROM products WHERE id=?", (pid,))
-        conn.commit()
-        return True, "Product deleted."
+        _clear_catalog_caches()
+        return True,"Deleted"
 
-# Wishlist & reviews
+# Wishlist & reviews & orders
 def add_wishlist(user_id, product_id):
     try:
-        with get_conn() as conn:
+        with get_write_conn() as conn:
             c = conn.cursor()
-            c.execute("INSERT OR IGNORE INTO wishlist(user_id, product_id, created_at) VALUES (?, ?, ?)",
+            c.execute("INSERT OR IGNORE INTO wishlist(user_id, product_id, created_at) VALUES (?,?,?)",
                       (user_id, product_id, datetime.utcnow().isoformat()))
-            conn.commit()
             return True, "Added to wishlist."
     except Exception as e:
-        return False, f"Error: {e}"
+        return False, str(e)
 
 def remove_wishlist(user_id, product_id):
-    with get_conn() as conn:
+    with get_write_conn() as conn:
         c = conn.cursor()
         c.execute("DELETE FROM wishlist WHERE user_id=? AND product_id=?", (user_id, product_id))
-        conn.commit()
         return True, "Removed from wishlist."
 
 def get_wishlist(user_id):
-    with get_conn() as conn:
-        c = conn.cursor()
-        c.execute("""
-            SELECT p.*,
-            (SELECT COALESCE(AVG(rating),0) FROM reviews r WHERE r.product_id=p.id) AS avg_rating
-            FROM wishlist w JOIN products p ON p.id = w.product_id
-            WHERE w.user_id=?
-            ORDER BY datetime(w.created_at) DESC
-        """, (user_id,))
-        return c.fetchall()
+    with get_read_conn() as conn:
+        c = _tuple_cursor(conn)
+        c.execute(f"""SELECT {_CARD_COLS_P}
+                     FROM wishlist w JOIN products p ON p.id = w.product_id
+                     WHERE w.user_id=?
+                     ORDER BY w.created_at DESC""", (user_id,))
+        return _fetch_dicts(c)
 
 def add_review(user_id, product_id, rating, comment):
     if rating < 1 or rating > 5:
-        return False, "Rating 1-5 required."
-    with get_conn() as conn:
+        return False, "Rating 1-5"
+    with get_write_conn() as conn:
         c = conn.cursor()
         now = datetime.utcnow().isoformat()
         try:
-            c.execute("""
-                INSERT INTO reviews(user_id, product_id, rating, comment, created_at)
-                VALUES (?, ?, ?, ?, ?)
-            """, (user_id, product_id, rating, comment, now))
+            c.execute("INSERT INTO reviews(user_id,product_id,rating,comment,created_at) VALUES (?,?,?,?,?)",
+                      (user_id, product_id, rating, comment, now))
         except sqlite3.IntegrityError:
-            c.execute("""
-                UPDATE reviews SET rating=?, comment=?, created_at=?
-                WHERE user_id=? AND product_id=?
-            """, (rating, comment, now, user_id, product_id))
-        conn.commit()
+            c.execute("UPDATE reviews SET rating=?, comment=?, created_at=? WHERE user_id=? AND product_id=?",
+                      (rating, comment, now, user_id, product_id))
+        list_products.clear()
+        get_product.clear()  # avg_rating / review_count changed
+        get_reviews.clear()
         return True, "Review saved."
 
-def get_reviews(product_id):
-    with get_conn() as conn:
-        c = conn.cursor()
-        c.execute("""
-            SELECT r.*, u.username FROM reviews r
-            JOIN users u ON u.id = r.user_id
-            WHERE r.product_id=?
-            ORDER BY datetime(r.created_at) DESC
-        """, (product_id,))
-        return c.fetchall()
+@st.cache_data(ttl=60, max_entries=512, show_spinner=False)
+def get_reviews(product_id, limit: Optional[int] = None, offset: int = 0):
+    """Newest first; pass `limit` to fetch a single page instead of every review."""
+    sql = "SELECT r.*, u.username FROM reviews r JOIN users u ON u.id = r.user_id WHERE r.product_id=? ORDER BY r.created_at DESC"
+    with get_read_conn() as conn:
+        c = _tuple_cursor(conn)
+        if limit is None:
+            c.execute(sql, (product_id,))
+        else:
+            c.execute(sql + " LIMIT ? OFFSET ?", (product_id, limit, offset))
+        return _fetch_dicts(c)
 
-# Orders & checkout
-def place_order(user_id, cart_items):
-    if not cart_items: return False, "Cart empty.", None
-    now = datetime.utcnow().isoformat()
-    with get_conn() as conn:
+def place_order(user_id, cart_items: List[Dict[str,Any]]):
+    if not cart_items:
+        return False, "Cart empty.", None
+    with get_write_conn() as conn:
         try:
             c = conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            # Merge repeated lines so each product row is checked against its total quantity
+            qty_by_id: Dict[int, int] = Counter()
             for it in cart_items:
-                c.execute("SELECT stock FROM products WHERE id=?", (it["id"],))
-                row = c.fetchone()
-                if not row or row["stock"] < it["quantity"]:
-                    return False, f"Not enough stock for {it['name']}.", None
-            total = sum(it["price"] * it["quantity"] for it in cart_items)
-            c.execute("INSERT INTO orders(user_id, created_at, total) VALUES (?, ?, ?)", (user_id, now, total))
+                qty_by_id[it["id"]] += it["quantity"]
+            # One set-based check-and-decrement: a product with too little stock updates no row,
+            # so changes() falls short of the distinct ids and nothing is written.
+            values = ",".join(["(?,?)"] * len(qty_by_id))
+            c.execute(f"""
+                WITH deltas(pid, qty) AS (VALUES {values})
+                UPDATE products SET stock = stock - (SELECT qty FROM deltas WHERE pid = products.id)
+                WHERE id IN (SELECT pid FROM deltas)
+                  AND stock >= (SELECT qty FROM deltas WHERE pid = products.id)""",
+                [v for pid, qty in qty_by_id.items() for v in (pid, qty)])
+            # cursor.rowcount isn't set for WITH-prefixed statements
+            if c.execute("SELECT changes()").fetchone()[0] != len(qty_by_id):
+                conn.rollback()
+                c.execute(f"SELECT id, stock FROM products WHERE id IN ({','.join('?'*len(qty_by_id))})",
+                          list(qty_by_id))
+                stock = {r["id"]: r["stock"] for r in c.fetchall()}
+                short = next((it for it in cart_items if stock.get(it["id"], 0) < qty_by_id[it["id"]]), None)
+                name = short["name"] if short else "an item in your cart"
+                return False, f"Not enough stock for {name}.", None
+            # Charge the stored integer price, not whatever the cart captured; cents -> dollars once
+            c.execute(f"SELECT id, price_cents FROM products WHERE id IN ({','.join('?'*len(qty_by_id))})",
+                      list(qty_by_id))
+            cents = {r["id"]: r["price_cents"] for r in c.fetchall()}
+            total_cents = sum(cents[pid] * qty for pid, qty in qty_by_id.items())
+            now = datetime.utcnow().isoformat()
+            c.execute("INSERT INTO orders(user_id, created_at, total) VALUES (?,?,?)", (user_id, now, total_cents / 100))
             order_id = c.lastrowid
-            for it in cart_items:
-                c.execute("""
-                    INSERT INTO order_items(order_id, product_id, quantity, price_each)
-                    VALUES (?, ?, ?, ?)
-                """, (order_id, it["id"], it["quantity"], it["price"]))
-                c.execute("UPDATE products SET stock = stock - ? WHERE id=?", (it["quantity"], it["id"]))
+            c.executemany("INSERT INTO order_items(order_id,product_id,quantity,price_each) VALUES (?,?,?,?)",
+                          [(order_id, it["id"], it["quantity"], cents[it["id"]] / 100) for it in cart_items])
             conn.commit()
+            list_products.clear()
+            get_product.clear()  # stock changed
+            admin_metrics.clear()
             return True, "Order placed.", order_id
         except Exception as e:
             conn.rollback()
-            return False, f"Error placing order: {e}", None
+            return False, str(e), None
 
 def list_orders(user_id):
-    with get_conn() as conn:
+    with get_read_conn() as conn:
+        c = _tuple_cursor(conn)
+        c.execute("SELECT * FROM orders WHERE user_id=? ORDER BY created_at DESC", (user_id,))
+        return _fetch_dicts(c)
+
+def order_items(order_id):
+    with get_read_conn() as conn:
         c = conn.cursor()
-        c.execute("SELECT * FROM orders WHERE user_id=? ORDER BY datetime(created_at) DESC", (user_id,))
+        c.execute("SELECT oi.*, p.name, p.image FROM order_items oi JOIN products p ON p.id = oi.product_id WHERE oi.order_id=?", (order_id,))
         return c.fetchall()
 
-def order_items(order_id):
-    with get_conn() as conn:
+def order_items_bulk(order_ids: List[int]) -> Dict[int, List[sqlite3.Row]]:
+    """Items for several orders in one query, bucketed by order_id."""
+    grouped: Dict[int, List[sqlite3.Row]] = {oid: [] for oid in order_ids}
+    if not order_ids:
+        return grouped
+    placeholders = ",".join("?" * len(order_ids))
+    with get_read_conn() as conn:
+        c = conn.cursor()
+        c.execute(f"""SELECT oi.order_id, oi.quantity, oi.price_each, p.name, p.image
+                      FROM order_items oi JOIN products p ON p.id = oi.product_id
+                      WHERE oi.order_id IN ({placeholders})""", order_ids)
+        for r in c.fetchall():
+            grouped[r["order_id"]].append(r)
+        return grouped
+
+def list_releases():
+    with get_read_conn() as conn:
         c = conn.cursor()
-        c.execute("""
-            SELECT oi.*, p.name, p.image
-            FROM order_items oi JOIN products p ON p.id = oi.product_id
-            WHERE oi.order_id=?
-        """, (order_id,))
+        c.execute("SELECT r.*, p.name as product_name FROM releases r LEFT JOIN products p ON p.id=r.product_id ORDER BY drop_datetime ASC")
         return c.fetchall()
 
+def search_stores(city_query=""):
+    with get_read_conn() as conn:
+        c = conn.cursor()
+        if city_query:
+            c.execute("SELECT * FROM stores WHERE LOWER(city) LIKE ? ORDER BY city", (f"%{city_query.lower()}%",))
+        else:
+            c.execute("SELECT * FROM stores ORDER BY city")
+        return c.fetchall()
+
+# Short TTL: revenue/low-stock are admin-facing and writers clear it anyway
+@st.cache_data(ttl=30, show_spinner=False)
 def admin_metrics():
-    with get_conn() as conn:
+    with get_read_conn() as conn:
         c = conn.cursor()
-        c.execute("SELECT COUNT(*) FROM users"); users = c.fetchone()[0]
-        c.execute("SELECT COUNT(*) FROM orders"); orders = c.fetchone()[0]
-        c.execute("SELECT COALESCE(SUM(total),0) FROM orders"); revenue = c.fetchone()[0] or 0
-        c.execute("SELECT COUNT(*) FROM products"); products = c.fetchone()[0]
-        c.execute("SELECT id, name, stock FROM products WHERE stock <= 5 ORDER BY stock ASC")
-        low_stock = c.fetchall()
+        # COUNT/COALESCE never yield NULL, so the row unpacks directly
+        c.execute("""SELECT (SELECT COUNT(*) FROM users), (SELECT COUNT(*) FROM orders),
+                            (SELECT COALESCE(SUM(total),0) FROM orders), (SELECT COUNT(*) FROM products)""")
+        users, orders, revenue, products = c.fetchone()
+        c.execute("SELECT id, name, stock FROM products WHERE stock <= 5 ORDER BY stock ASC LIMIT 20")
+        low_stock = [dict(r) for r in c.fetchall()]  # plain dicts: st.cache_data must pickle them
         return {"users": users, "orders": orders, "revenue": revenue, "products": products, "low_stock": low_stock}
-
-# initialize
-init_db()
-seed_products()
-seed_admin()
@@ -0,0 +1,27 @@
+# ui_utils.py
+"""Small Streamlit-side helpers shared by the app pages."""
+from __future__ import annotations
+
+import streamlit as st
+
+_STARS = tuple("★"*i + "☆"*(5-i) for i in range(6))
+
+def stars(avg):
+    filled = int(round(avg)) if avg is not None else 0
+    return _STARS[max(0, min(5, filled))]
+
+def fmt_cents(cents) -> str:
+    cents = int(cents or 0)
+    return f"${cents // 100}.{cents % 100:02d}"
+
+def logout_local():
+    st.session_state.user = None
+    st.session_state.cart = {}
+    st.session_state.view_product = None
+
+def add_to_cart_local(pid:int, name:str, price_cents:int, qty:int):
+    cart = st.session_state.cart
+    if pid in cart:
+        cart[pid]["quantity"] += qty
+    else:
+        cart[pid] = {"name": name, "price_cents": price_cents, "quantity": qty}